@@ -188,6 +188,12 @@ class AnsibleAWSModule(object):
     def md5(self, *args, **kwargs):
         return self._module.md5(*args, **kwargs)
 
+    def add_cleanup_file(self, *args, **kwargs):
+        return self._module.add_cleanup_file(*args, **kwargs)
+
+    def atomic_move(self, *args, **kwargs):
+        return self._module.atomic_move(*args, **kwargs)
+
     def client(self, service, retry_decorator=None):
         region, ec2_url, aws_connect_kwargs = get_aws_connection_info(self, boto3=True)
         conn = boto3_conn(self, conn_type='client', resource=service,
@@ -19,7 +19,33 @@ except ImportError:
         HAS_MD5 = False
 
 
-import string
+import mmap
+import os
+import re
+
+
+_ILLEGAL_BUCKET_NAME_CHARACTERS = re.compile(r'[^a-z0-9.-]')
+_LEGAL_BUCKET_NAME_EDGE = re.compile(r'[a-z0-9]')
+_valid_bucket_names = set()
+
+
+def _md5(data=b''):
+    # ETags aren't used for anything security related, flag it as such so
+    # that the digest is still available on FIPS enabled hosts (Python 3.9+)
+    try:
+        return md5(data, usedforsecurity=False)
+    except TypeError:
+        return md5(data)
+
+
+def _md5_file(filename):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _md5().hexdigest()
+        # Hash the page cache directly rather than copying the file through
+        # read buffers
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _md5(data).hexdigest()
 
 
 def calculate_etag(module, filename, etag, s3, bucket, obj, version=None):
@@ -45,12 +71,12 @@ def calculate_etag(module, filename, etag, s3, bucket, obj, version=None):
                     head = s3.head_object(**s3_kwargs)
                 except (BotoCoreError, ClientError) as e:
                     module.fail_json_aws(e, msg="Failed to get head object")
-                digests.append(md5(f.read(int(head['ContentLength']))))
+                digests.append(_md5(f.read(int(head['ContentLength']))))
 
-        digest_squared = md5(b''.join(m.digest() for m in digests))
+        digest_squared = _md5(b''.join(m.digest() for m in digests))
         return '"{0}-{1}"'.format(digest_squared.hexdigest(), len(digests))
     else:  # Compute the MD5 sum normally
-        return '"{0}"'.format(module.md5(filename))
+        return '"{0}"'.format(_md5_file(filename))
 
 
 def calculate_etag_content(module, content, etag, s3, bucket, obj, version=None):
@@ -70,6 +96,8 @@ def calculate_etag_content(module, content, etag, s3, bucket, obj, version=None)
         if version:
             s3_kwargs['VersionId'] = version
 
+        # Slicing a memoryview doesn't copy the part
+        view = memoryview(content)
         for part_num in range(1, parts + 1):
             s3_kwargs['PartNumber'] = part_num
             try:
@@ -77,26 +105,33 @@ def calculate_etag_content(module, content, etag, s3, bucket, obj, version=None)
             except (BotoCoreError, ClientError) as e:
                 module.fail_json_aws(e, msg="Failed to get head object")
             length = int(head['ContentLength'])
-            digests.append(md5(content[offset:offset + length]))
+            digests.append(_md5(view[offset:offset + length]))
             offset += length
 
-        digest_squared = md5(b''.join(m.digest() for m in digests))
+        digest_squared = _md5(b''.join(m.digest() for m in digests))
         return '"{0}-{1}"'.format(digest_squared.hexdigest(), len(digests))
     else:  # Compute the MD5 sum normally
-        return '"{0}"'.format(md5(content).hexdigest())
+        return '"{0}"'.format(_md5(content).hexdigest())
 
 
-def validate_bucket_name(module, name):
+def _bucket_name_error(name):
     # See: https://docs.aws.amazon.com/AmazonS3/latest/userguide/bucketnamingrules.html
     if len(name) < 4:
-        module.fail_json(msg='the S3 bucket name is too short')
+        return 'the S3 bucket name is too short'
     if len(name) > 63:
-        module.fail_json(msg='the length of an S3 bucket cannot exceed 63 characters')
-
-    legal_characters = string.ascii_lowercase + ".-" + string.digits
-    illegal_characters = [c for c in name if c not in legal_characters]
-    if illegal_characters:
-        module.fail_json(msg='invalid character(s) found in the bucket name')
-    if name[-1] not in string.ascii_lowercase + string.digits:
-        module.fail_json(msg='bucket names must begin and end with a letter or number')
+        return 'the length of an S3 bucket cannot exceed 63 characters'
+    if _ILLEGAL_BUCKET_NAME_CHARACTERS.search(name):
+        return 'invalid character(s) found in the bucket name'
+    if not _LEGAL_BUCKET_NAME_EDGE.match(name[-1]):
+        return 'bucket names must begin and end with a letter or number'
+    return None
+
+
+def validate_bucket_name(module, name):
+    if name not in _valid_bucket_names:
+        error = _bucket_name_error(name)
+        if error:
+            module.fail_json(msg=error)
+        else:
+            _valid_bucket_names.add(name)
     return True
@@ -57,6 +57,23 @@ options:
       - Max number of results to return in list mode, set this if you want to retrieve fewer than the default 1000 keys.
     default: 1000
     type: int
+  max_concurrency:
+    description:
+      - The maximum number of threads used to transfer the parts of a multipart upload or download.
+      - Also limits the number of concurrent DeleteObjects requests when deleting the contents of a bucket with I(mode=delete).
+      - Must be at least C(1).
+    default: 16
+    type: int
+    version_added: 3.1.0
+  multipart_chunksize:
+    description:
+      - The size in bytes of each part of a multipart upload, or of each ranged request of a multipart download.
+        Objects smaller than this are transferred in a single request.
+      - When not set, uploads use 64 MiB parts, and downloads of objects larger than 8 MiB use 16 MiB ranged requests.
+      - The part size of uploads is automatically increased when needed to stay within the 10,000 parts limit of S3.
+      - Must be at least C(1).
+    type: int
+    version_added: 3.1.0
   metadata:
     description:
       - Metadata for PUT/COPY operation, as a dictionary of C(key=value) and C(key=value,key=value).
@@ -115,6 +132,7 @@ options:
   retries:
     description:
      - On recoverable failure, how many times to retry before actually failing.
+     - Failed requests are retried with an exponential backoff. When set to C(0) the botocore defaults are used.
     default: 0
     type: int
     aliases: ['retry']
@@ -349,8 +367,14 @@ s3_keys:
   - prefix1/key2
 '''
 
+import itertools
 import mimetypes
 import os
+import random
+import tempfile
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 import io
 from ssl import SSLError
 import base64
@@ -358,11 +382,14 @@ import time
 
 try:
     import botocore
+    from boto3.s3.transfer import TransferConfig
+    from s3transfer.exceptions import RetriesExceededError
 except ImportError:
     pass  # Handled by AnsibleAWSModule
 
 from ansible.module_utils.basic import to_text
 from ansible.module_utils.basic import to_native
+from ansible.module_utils.six.moves.urllib.parse import urlencode
 from ansible.module_utils.six.moves.urllib.parse import urlparse
 
 from ..module_utils.core import AnsibleAWSModule
@@ -379,18 +406,54 @@ from ..module_utils.s3 import calculate_etag_content
 from ..module_utils.s3 import validate_bucket_name
 
 IGNORE_S3_DROP_IN_EXCEPTIONS = ['XNotImplemented', 'NotImplemented']
+DEFAULT_MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+DOWNLOAD_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+DOWNLOAD_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+MAX_MULTIPART_PARTS = 10000
+MAX_DELETE_OBJECTS_KEYS = 1000
+TAGS_WAIT_TIMEOUT = 60
+MULTIPART_COPY_HEADERS = ('CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage',
+                          'ContentType', 'Expires', 'WebsiteRedirectLocation')
+# Arguments S3 expects again on each UploadPartCopy request
+MULTIPART_COPY_PART_ARGS = ('RequestPayer', 'SSECustomerAlgorithm', 'SSECustomerKey', 'SSECustomerKeyMD5')
+
+ALLOWED_EXTRA_ARGS = {'acl': 'ACL', 'cachecontrol': 'CacheControl', 'contentdisposition': 'ContentDisposition',
+                      'contentencoding': 'ContentEncoding', 'contentlanguage': 'ContentLanguage',
+                      'contenttype': 'ContentType', 'expires': 'Expires', 'grantfullcontrol': 'GrantFullControl',
+                      'grantread': 'GrantRead', 'grantreadacp': 'GrantReadACP', 'grantwriteacp': 'GrantWriteACP',
+                      'metadata': 'Metadata', 'requestpayer': 'RequestPayer', 'serversideencryption': 'ServerSideEncryption',
+                      'storageclass': 'StorageClass', 'ssecustomeralgorithm': 'SSECustomerAlgorithm', 'ssecustomerkey': 'SSECustomerKey',
+                      'ssecustomerkeymd5': 'SSECustomerKeyMD5', 'ssekmskeyid': 'SSEKMSKeyId', 'websiteredirectlocation': 'WebsiteRedirectLocation'}
+
+OBJECT_CANNED_ACL = frozenset(["private", "public-read", "public-read-write", "aws-exec-read", "authenticated-read",
+                               "bucket-owner-read", "bucket-owner-full-control"])
+BUCKET_CANNED_ACL = frozenset(["private", "public-read", "public-read-write", "authenticated-read"])
+
+_head_object_cache = {}
+_s3_client_cache = {}
 
 
 class Sigv4Required(Exception):
     pass
 
 
-def key_check(module, s3, bucket, obj, version=None, validate=True):
-    try:
+def head_object(s3, bucket, obj, version=None):
+    # The same object is often looked up several times while deciding what to
+    # do (key_check, etag_compare, is_local_object_latest...), only issue a
+    # single HeadObject request for it.  Objects are only written right before
+    # the module exits, so the cached responses never go stale.
+    cache_key = (bucket, obj, version)
+    if cache_key not in _head_object_cache:
         if version:
-            s3.head_object(Bucket=bucket, Key=obj, VersionId=version)
+            _head_object_cache[cache_key] = s3.head_object(Bucket=bucket, Key=obj, VersionId=version)
         else:
-            s3.head_object(Bucket=bucket, Key=obj)
+            _head_object_cache[cache_key] = s3.head_object(Bucket=bucket, Key=obj)
+    return _head_object_cache[cache_key]
+
+
+def key_check(module, s3, bucket, obj, version=None, validate=True):
+    try:
+        head_object(s3, bucket, obj, version=version)
     except is_boto3_error_code('404'):
         return False
     except is_boto3_error_code('403') as e:  # pylint: disable=duplicate-except
@@ -414,10 +477,7 @@ def etag_compare(module, s3, bucket, obj, version=None, local_file=None, content
 
 def get_etag(s3, bucket, obj, version=None):
     try:
-        if version:
-            key_check = s3.head_object(Bucket=bucket, Key=obj, VersionId=version)
-        else:
-            key_check = s3.head_object(Bucket=bucket, Key=obj)
+        key_check = head_object(s3, bucket, obj, version=version)
         if not key_check:
             return None
         return key_check['ETag']
@@ -425,22 +485,11 @@ def get_etag(s3, bucket, obj, version=None):
         return None
 
 
-def get_s3_last_modified_timestamp(s3, bucket, obj, version=None):
-    if version:
-        key_check = s3.head_object(Bucket=bucket, Key=obj, VersionId=version)
-    else:
-        key_check = s3.head_object(Bucket=bucket, Key=obj)
-    if not key_check:
-        return None
-    return key_check['LastModified'].timestamp()
-
-
 def is_local_object_latest(module, s3, bucket, obj, version=None, local_file=None):
-    s3_last_modified = get_s3_last_modified_timestamp(s3, bucket, obj, version)
     if os.path.exists(local_file) is False:
         return False
-    else:
-        local_last_modified = os.path.getmtime(local_file)
+    local_last_modified = os.path.getmtime(local_file)
+    s3_last_modified = head_object(s3, bucket, obj, version=version)['LastModified'].timestamp()
 
     return s3_last_modified <= local_last_modified
 
@@ -461,6 +510,21 @@ def bucket_check(module, s3, bucket, validate=True):
     return exists
 
 
+def put_canned_acl(module, s3, bucket, obj=None):
+    # A canned ACL replaces the whole ACL of the object/bucket, applying each
+    # requested permission in turn leaves only the last one in place.  Skip
+    # straight to it rather than paying a round-trip per permission.
+    permissions = module.params.get('permission')
+    if not permissions:
+        return
+    if obj is None:
+        AWSRetry.jittered_backoff(
+            max_delay=120, catch_extra_error_codes=['NoSuchBucket']
+        )(s3.put_bucket_acl)(ACL=permissions[-1], Bucket=bucket)
+    else:
+        s3.put_object_acl(ACL=permissions[-1], Bucket=bucket, Key=obj)
+
+
 def create_bucket(module, s3, bucket, location=None):
     if module.check_mode:
         module.exit_json(msg="CREATE operation skipped - running in check mode", changed=True)
@@ -475,10 +539,7 @@ def create_bucket(module, s3, bucket, location=None):
         if module.params.get('permission'):
             # Wait for the bucket to exist before setting ACLs
             s3.get_waiter('bucket_exists').wait(Bucket=bucket)
-        for acl in module.params.get('permission'):
-            AWSRetry.jittered_backoff(
-                max_delay=120, catch_extra_error_codes=['NoSuchBucket']
-            )(s3.put_bucket_acl)(ACL=acl, Bucket=bucket)
+        put_canned_acl(module, s3, bucket)
     except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS):
         module.warn("PutBucketAcl is not implemented by your storage provider. Set the permission parameters to the empty list to avoid this warning")
     except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:  # pylint: disable=duplicate-except
@@ -491,19 +552,28 @@ def create_bucket(module, s3, bucket, location=None):
 def paginated_list(s3, **pagination_params):
     pg = s3.get_paginator('list_objects_v2')
     for page in pg.paginate(**pagination_params):
-        yield [data['Key'] for data in page.get('Contents', [])]
+        for data in page.get('Contents', ()):
+            yield data['Key']
 
 
 def paginated_versioned_list_with_fallback(s3, **pagination_params):
     try:
         versioned_pg = s3.get_paginator('list_object_versions')
         for page in versioned_pg.paginate(**pagination_params):
-            delete_markers = [{'Key': data['Key'], 'VersionId': data['VersionId']} for data in page.get('DeleteMarkers', [])]
-            current_objects = [{'Key': data['Key'], 'VersionId': data['VersionId']} for data in page.get('Versions', [])]
-            yield delete_markers + current_objects
+            # Only the Key and VersionId are needed to delete the objects
+            for data in itertools.chain(page.get('DeleteMarkers', ()), page.get('Versions', ())):
+                yield {'Key': data['Key'], 'VersionId': data['VersionId']}
     except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS + ['AccessDenied']):
-        for page in paginated_list(s3, **pagination_params):
-            yield [{'Key': data['Key']} for data in page]
+        for key in paginated_list(s3, **pagination_params):
+            yield {'Key': key}
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
 
 
 def list_keys(module, s3, bucket, prefix, marker, max_keys):
@@ -511,7 +581,7 @@ def list_keys(module, s3, bucket, prefix, marker, max_keys):
     for param_name, param_value in (('Prefix', prefix), ('StartAfter', marker), ('MaxKeys', max_keys)):
         pagination_params[param_name] = param_value
     try:
-        keys = sum(paginated_list(s3, **pagination_params), [])
+        keys = list(paginated_list(s3, **pagination_params))
         module.exit_json(msg="LIST operation complete", s3_keys=keys)
     except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
         module.fail_json_aws(e, msg="Failed while listing the keys in the bucket {0}".format(bucket))
@@ -525,9 +595,22 @@ def delete_bucket(module, s3, bucket):
         if exists is False:
             return False
         # if there are contents then we need to delete them before we can delete the bucket
-        for keys in paginated_versioned_list_with_fallback(s3, Bucket=bucket):
-            if keys:
-                s3.delete_objects(Bucket=bucket, Delete={'Objects': keys})
+        delete_objects = AWSRetry.jittered_backoff(max_delay=120, catch_extra_error_codes=['SlowDown'])(s3.delete_objects)
+        max_workers = module.params.get('max_concurrency')
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            # DeleteObjects accepts at most 1000 keys, don't rely on the
+            # listing pages staying under that limit
+            objects = paginated_versioned_list_with_fallback(s3, Bucket=bucket)
+            for keys in chunks(objects, MAX_DELETE_OBJECTS_KEYS):
+                pending.add(executor.submit(delete_objects, Bucket=bucket, Delete={'Objects': keys, 'Quiet': True}))
+                # Don't list the whole bucket ahead of the deletions
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            for future in pending:
+                future.result()
         s3.delete_bucket(Bucket=bucket)
         return True
     except is_boto3_error_code('NoSuchBucket'):
@@ -557,15 +640,14 @@ def create_dirkey(module, s3, bucket, obj, encrypt, expiry):
             params['SSEKMSKeyId'] = module.params['encryption_kms_key_id']
 
         s3.put_object(**params)
-        for acl in module.params.get('permission'):
-            s3.put_object_acl(ACL=acl, Bucket=bucket, Key=obj)
+        put_canned_acl(module, s3, bucket, obj)
     except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS):
         module.warn("PutObjectAcl is not implemented by your storage provider. Set the permissions parameters to the empty list to avoid this warning")
     except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:  # pylint: disable=duplicate-except
         module.fail_json_aws(e, msg="Failed while creating object %s." % obj)
 
     # Tags
-    tags, changed = ensure_tags(s3, module, bucket, obj)
+    tags, changed = ensure_tags(s3, module, bucket, obj, new_object=True)
 
     try:
         url = s3.generate_presigned_url(ClientMethod='put_object',
@@ -586,19 +668,40 @@ def path_check(path):
         return False
 
 
-def option_in_extra_args(option):
-    temp_option = option.replace('-', '').lower()
-
-    allowed_extra_args = {'acl': 'ACL', 'cachecontrol': 'CacheControl', 'contentdisposition': 'ContentDisposition',
-                          'contentencoding': 'ContentEncoding', 'contentlanguage': 'ContentLanguage',
-                          'contenttype': 'ContentType', 'expires': 'Expires', 'grantfullcontrol': 'GrantFullControl',
-                          'grantread': 'GrantRead', 'grantreadacp': 'GrantReadACP', 'grantwriteacp': 'GrantWriteACP',
-                          'metadata': 'Metadata', 'requestpayer': 'RequestPayer', 'serversideencryption': 'ServerSideEncryption',
-                          'storageclass': 'StorageClass', 'ssecustomeralgorithm': 'SSECustomerAlgorithm', 'ssecustomerkey': 'SSECustomerKey',
-                          'ssecustomerkeymd5': 'SSECustomerKeyMD5', 'ssekmskeyid': 'SSEKMSKeyId', 'websiteredirectlocation': 'WebsiteRedirectLocation'}
-
-    if temp_option in allowed_extra_args:
-        return allowed_extra_args[temp_option]
+def metadata_to_extra_args(metadata):
+    """ Split metadata into S3 request arguments and user metadata in one pass """
+    extra = {}
+    user_metadata = {}
+    for option, value in metadata.items():
+        extra_args_option = ALLOWED_EXTRA_ARGS.get(option.replace('-', '').lower())
+        if extra_args_option is not None:
+            extra[extra_args_option] = value
+        else:
+            user_metadata[option] = value
+    extra.setdefault('Metadata', user_metadata)
+    return extra
+
+
+def get_transfer_config(module, size=None):
+    chunksize = module.params.get('multipart_chunksize') or DEFAULT_MULTIPART_CHUNKSIZE
+    if size:
+        # S3 refuses multipart uploads with more than 10,000 parts
+        chunksize = max(chunksize, -(-size // MAX_MULTIPART_PARTS))
+    return TransferConfig(multipart_threshold=chunksize, multipart_chunksize=chunksize,
+                          max_concurrency=module.params.get('max_concurrency'), use_threads=True)
+
+
+def get_download_transfer_config(module):
+    # Ranged GETs have no part count limit, keep s3transfer's 8 MiB threshold
+    # so that mid-sized objects are still fetched in parallel.
+    chunksize = module.params.get('multipart_chunksize')
+    if chunksize:
+        threshold = chunksize
+    else:
+        threshold = DOWNLOAD_MULTIPART_THRESHOLD
+        chunksize = DOWNLOAD_MULTIPART_CHUNKSIZE
+    return TransferConfig(multipart_threshold=threshold, multipart_chunksize=chunksize,
+                          max_concurrency=module.params.get('max_concurrency'), use_threads=True)
 
 
 def upload_s3file(module, s3, bucket, obj, expiry, metadata, encrypt, headers, src=None, content=None):
@@ -611,15 +714,8 @@ def upload_s3file(module, s3, bucket, obj, expiry, metadata, encrypt, headers, s
         if module.params['encryption_kms_key_id'] and module.params['encryption_mode'] == 'aws:kms':
             extra['SSEKMSKeyId'] = module.params['encryption_kms_key_id']
         if metadata:
-            extra['Metadata'] = {}
-
             # determine object metadata and extra arguments
-            for option in metadata:
-                extra_args_option = option_in_extra_args(option)
-                if extra_args_option is not None:
-                    extra[extra_args_option] = metadata[option]
-                else:
-                    extra['Metadata'][option] = metadata[option]
+            extra.update(metadata_to_extra_args(metadata))
 
         if module.params.get('permission'):
             permissions = module.params['permission']
@@ -638,41 +734,52 @@ def upload_s3file(module, s3, bucket, obj, expiry, metadata, encrypt, headers, s
             extra['ContentType'] = content_type
 
         if src is not None:
-            s3.upload_file(Filename=src, Bucket=bucket, Key=obj, ExtraArgs=extra)
+            size = os.path.getsize(src)
+            config = get_transfer_config(module, size)
+            if size < config.multipart_threshold:
+                # Small files fit in a single request, skip the transfer
+                # manager and its thread pool
+                with open(src, 'rb') as f:
+                    s3.put_object(Body=f, ContentLength=size, Bucket=bucket, Key=obj, **extra)
+            else:
+                s3.upload_file(Filename=src, Bucket=bucket, Key=obj, ExtraArgs=extra, Config=config)
         else:
-            f = io.BytesIO(content)
-            s3.upload_fileobj(Fileobj=f, Bucket=bucket, Key=obj, ExtraArgs=extra)
+            config = get_transfer_config(module, len(content))
+            if len(content) < config.multipart_threshold:
+                # Small payloads fit in a single request, skip the transfer
+                # manager and its thread pool
+                s3.put_object(Body=content, Bucket=bucket, Key=obj, **extra)
+            else:
+                f = io.BytesIO(content)
+                s3.upload_fileobj(Fileobj=f, Bucket=bucket, Key=obj, ExtraArgs=extra, Config=config)
     except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
         module.fail_json_aws(e, msg="Unable to complete PUT operation.")
     try:
-        for acl in module.params.get('permission'):
-            s3.put_object_acl(ACL=acl, Bucket=bucket, Key=obj)
+        put_canned_acl(module, s3, bucket, obj)
     except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS):
         module.warn("PutObjectAcl is not implemented by your storage provider. Set the permission parameters to the empty list to avoid this warning")
     except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:  # pylint: disable=duplicate-except
         module.fail_json_aws(e, msg="Unable to set object ACL")
 
     # Tags
-    tags, changed = ensure_tags(s3, module, bucket, obj)
+    tags, changed = ensure_tags(s3, module, bucket, obj, new_object=True)
 
     url = put_download_url(module, s3, bucket, obj, expiry)
 
     module.exit_json(msg="PUT operation complete", url=url, tags=tags, changed=True)
 
 
-def download_s3file(module, s3, bucket, obj, dest, retries, version=None):
+def download_s3file(module, s3, bucket, obj, dest, version=None):
     if module.check_mode:
         module.exit_json(msg="GET operation skipped - running in check mode", changed=True)
-    # retries is the number of loops; range/xrange needs to be one
-    # more to get that count of loops.
     try:
-        if version:
-            key = s3.get_object(Bucket=bucket, Key=obj, VersionId=version)
-        else:
-            key = s3.get_object(Bucket=bucket, Key=obj)
+        # HeadObject needs the same s3:GetObject permission as the download
+        # itself but doesn't transfer the body.  It's usually already been
+        # made (and cached) by key_check.
+        key = head_object(s3, bucket, obj, version=version)
     except is_boto3_error_code(['404', '403']) as e:
         # AccessDenied errors may be triggered if 1) file does not exist or 2) file exists but
-        # user does not have the s3:GetObject permission. 404 errors are handled by download_file().
+        # user does not have the s3:GetObject permission.
         module.fail_json_aws(e, msg="Could not find the key %s." % obj)
     except is_boto3_error_message('require AWS Signature Version 4'):  # pylint: disable=duplicate-except
         raise Sigv4Required()
@@ -681,21 +788,54 @@ def download_s3file(module, s3, bucket, obj, dest, retries, version=None):
     except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:  # pylint: disable=duplicate-except
         module.fail_json_aws(e, msg="Could not find the key %s." % obj)
 
+    size = key['ContentLength']
     optional_kwargs = {'ExtraArgs': {'VersionId': version}} if version else {}
-    for x in range(0, retries + 1):
-        try:
-            s3.download_file(bucket, obj, dest, **optional_kwargs)
-            module.exit_json(msg="GET operation complete", changed=True)
-        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
-            # actually fail on last pass through the loop.
-            if x >= retries:
-                module.fail_json_aws(e, msg="Failed while downloading %s." % obj)
-            # otherwise, try again, this may be a transient timeout.
-        except SSLError as e:  # will ClientError catch SSLError?
-            # actually fail on last pass through the loop.
-            if x >= retries:
-                module.fail_json_aws(e, msg="s3 download failed")
-            # otherwise, try again, this may be a transient timeout.
+    optional_kwargs['Config'] = get_download_transfer_config(module)
+    # Transient failures are retried with backoff by the client (see
+    # get_s3_connection), connection errors and timeouts while streaming the
+    # body are retried per ranged request by s3transfer.  s3transfer doesn't
+    # retry SSL errors, restart the download for those.
+    retries = module.params.get('retries')
+    try:
+        # Download next to dest and move it in place once complete, a failed
+        # download mustn't leave a truncated file behind.
+        fd, tmp_dest = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dest), dir=os.path.dirname(os.path.abspath(dest)))
+        module.add_cleanup_file(tmp_dest)
+        with open(fd, 'wb') as f:
+            if size and hasattr(os, 'posix_fallocate'):
+                try:
+                    # The parts are written out of order, reserve the space
+                    # up front rather than growing the file as they land
+                    os.posix_fallocate(f.fileno(), 0, size)
+                except OSError:
+                    pass
+            for x in range(0, retries + 1):
+                # s3transfer reports the bytes it writes (and takes them back
+                # when it retries a range) through the callback
+                transferred = []
+                try:
+                    s3.download_fileobj(bucket, obj, f, Callback=transferred.append, **optional_kwargs)
+                    break
+                except SSLError:
+                    # actually fail on last pass through the loop.
+                    if x >= retries:
+                        raise
+            # s3transfer looks the object up again, should it have been
+            # replaced by a smaller one in the meantime don't leave the end of
+            # the preallocated space in the file
+            f.truncate(sum(transferred))
+        module.atomic_move(tmp_dest, dest)
+        module.exit_json(msg="GET operation complete", changed=True)
+    except is_boto3_error_message('require AWS Signature Version 4'):
+        # HEAD responses have no body to carry this message, it only shows up
+        # once the object itself is requested
+        raise Sigv4Required()
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError, RetriesExceededError) as e:  # pylint: disable=duplicate-except
+        module.fail_json_aws(e, msg="Failed while downloading %s." % obj)
+    except SSLError as e:
+        module.fail_json_aws(e, msg="s3 download failed")
+    except OSError as e:
+        module.fail_json_aws(e, msg="Failed while downloading %s to %s." % (obj, dest))
 
 
 def download_s3str(module, s3, bucket, obj, version=None, validate=True):
@@ -735,6 +875,63 @@ def put_download_url(module, s3, bucket, obj, expiry):
     return url
 
 
+def copy_object_multipart(module, s3, params, src_head):
+    # Copy the parts of a multipart source in parallel, following the layout of
+    # the source so that the copy ends up with the same ETag (a plain
+    # CopyObject would produce a single part ETag, and every later run would
+    # see a difference).  This also lifts the 5GB limit of CopyObject.
+    copy_source = params['CopySource']
+    size = src_head['ContentLength']
+    part_head = s3.head_object(PartNumber=1, **copy_source)
+    part_size = part_head['ContentLength']
+    if not part_size:
+        # An empty first part (e.g. an empty object uploaded in one part)
+        # gives no layout to follow, such objects are small enough for
+        # CopyObject anyway.
+        s3.copy_object(**params)
+        return
+
+    upload_params = dict((k, v) for k, v in params.items() if k != 'CopySource')
+    # CreateMultipartUpload doesn't carry the source's metadata and tags over
+    # the way CopyObject does.  Copy them the way CopyObject's default COPY
+    # metadata directive would, ignoring the metadata requested by the task.
+    for header in MULTIPART_COPY_HEADERS:
+        upload_params.pop(header, None)
+        if header in src_head:
+            upload_params[header] = src_head[header]
+    upload_params['Metadata'] = src_head.get('Metadata', {})
+    try:
+        tag_set = s3.get_object_tagging(**copy_source)['TagSet']
+    except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS + ['NoSuchTagSet', 'NoSuchTagSetError']):
+        tag_set = []
+    if tag_set:
+        upload_params['Tagging'] = urlencode([(tag['Key'], tag['Value']) for tag in tag_set])
+
+    upload_id = s3.create_multipart_upload(**upload_params)['UploadId']
+
+    part_args = dict((k, params[k]) for k in MULTIPART_COPY_PART_ARGS if k in params)
+    # SSE-C arguments are only needed by CompleteMultipartUpload with
+    # checksums, which older botocore releases don't accept there
+    request_args = dict((k, params[k]) for k in ('RequestPayer',) if k in params)
+
+    def copy_part(part_number, start):
+        result = s3.upload_part_copy(Bucket=params['Bucket'], Key=params['Key'], UploadId=upload_id, PartNumber=part_number,
+                                     CopySource=copy_source, CopySourceRange='bytes=%d-%d' % (start, min(start + part_size, size) - 1),
+                                     **part_args)
+        return {'PartNumber': part_number, 'ETag': result['CopyPartResult']['ETag']}
+
+    try:
+        with ThreadPoolExecutor(max_workers=module.params.get('max_concurrency')) as executor:
+            futures = [executor.submit(copy_part, part_number, start)
+                       for part_number, start in enumerate(range(0, size, part_size), 1)]
+            parts = [future.result() for future in futures]
+        s3.complete_multipart_upload(Bucket=params['Bucket'], Key=params['Key'], UploadId=upload_id,
+                                     MultipartUpload={'Parts': parts}, **request_args)
+    except Exception:
+        s3.abort_multipart_upload(Bucket=params['Bucket'], Key=params['Key'], UploadId=upload_id, **request_args)
+        raise
+
+
 def copy_object_to_bucket(module, s3, bucket, obj, encrypt, metadata, validate, d_etag):
     if module.check_mode:
         module.exit_json(msg="COPY operation skipped - running in check mode", changed=True)
@@ -749,7 +946,11 @@ def copy_object_to_bucket(module, s3, bucket, obj, encrypt, metadata, validate,
             # Key does not exist in source bucket
             module.exit_json(msg="Key %s does not exist in bucket %s." % (bucketsrc['Key'], bucketsrc['Bucket']), changed=False)
 
-        s_etag = get_etag(s3, bucketsrc['Bucket'], bucketsrc['Key'], version=version)
+        # key_check has fetched (and cached) the source HeadObject, it carries
+        # everything the copy needs: the ETag and, for multipart copies, the
+        # size and content headers.
+        src_head = head_object(s3, bucketsrc['Bucket'], bucketsrc['Key'], version=version)
+        s_etag = src_head['ETag']
         if s_etag == d_etag:
             # Tags
             tags, changed = ensure_tags(s3, module, bucket, obj)
@@ -764,17 +965,13 @@ def copy_object_to_bucket(module, s3, bucket, obj, encrypt, metadata, validate,
             if module.params['encryption_kms_key_id'] and module.params['encryption_mode'] == 'aws:kms':
                 params['SSEKMSKeyId'] = module.params['encryption_kms_key_id']
             if metadata:
-                params['Metadata'] = {}
                 # determine object metadata and extra arguments
-                for option in metadata:
-                    extra_args_option = option_in_extra_args(option)
-                    if extra_args_option is not None:
-                        params[extra_args_option] = metadata[option]
-                    else:
-                        params['Metadata'][option] = metadata[option]
-            copy_result = s3.copy_object(**params)
-            for acl in module.params.get('permission'):
-                s3.put_object_acl(ACL=acl, Bucket=bucket, Key=obj)
+                params.update(metadata_to_extra_args(metadata))
+            if '-' in s_etag:
+                copy_object_multipart(module, s3, params, src_head)
+            else:
+                s3.copy_object(**params)
+            put_canned_acl(module, s3, bucket, obj)
             # Tags
             tags, changed = ensure_tags(s3, module, bucket, obj)
             module.exit_json(msg="Object copied from bucket %s to bucket %s." % (bucketsrc['Bucket'], bucket), tags=tags, changed=True)
@@ -784,20 +981,30 @@ def copy_object_to_bucket(module, s3, bucket, obj, encrypt, metadata, validate,
         module.fail_json_aws(e, msg="Failed while copying object %s from bucket %s." % (obj, module.params['copy_src'].get('Bucket')))
 
 
-def is_fakes3(s3_url):
-    """ Return True if s3_url has scheme fakes3:// """
-    if s3_url is not None:
-        return urlparse(s3_url).scheme in ('fakes3', 'fakes3s')
+def is_fakes3(parsed_url):
+    """ Return True if the parsed s3_url has scheme fakes3:// """
+    if parsed_url is not None:
+        return parsed_url.scheme in ('fakes3', 'fakes3s')
     else:
         return False
 
 
 def get_s3_connection(module, aws_connect_kwargs, location, rgw, s3_url, sig_4=False):
+    # Size the connection pool for the transfer threads so that they reuse
+    # connections rather than opening (and TLS negotiating) new ones.  Leave
+    # headroom for requests made alongside them, such as the listing that
+    # feeds the DeleteObjects workers.  Connections are only opened on demand.
+    retries = {'mode': 'adaptive'}
+    if module.params.get('retries'):
+        retries['max_attempts'] = module.params['retries']
+    config = botocore.client.Config(max_pool_connections=max(10, 2 * module.params.get('max_concurrency')), retries=retries)
+
+    parsed_url = urlparse(s3_url) if s3_url else None
     if s3_url and rgw:  # TODO - test this
-        rgw = urlparse(s3_url)
-        params = dict(module=module, conn_type='client', resource='s3', use_ssl=rgw.scheme == 'https', region=location, endpoint=s3_url, **aws_connect_kwargs)
-    elif is_fakes3(s3_url):
-        fakes3 = urlparse(s3_url)
+        params = dict(module=module, conn_type='client', resource='s3', use_ssl=parsed_url.scheme == 'https',
+                      region=location, endpoint=s3_url, **aws_connect_kwargs)
+    elif is_fakes3(parsed_url):
+        fakes3 = parsed_url
         port = fakes3.port
         if fakes3.scheme == 'fakes3s':
             protocol = "https"
@@ -813,16 +1020,21 @@ def get_s3_connection(module, aws_connect_kwargs, location, rgw, s3_url, sig_4=F
     else:
         params = dict(module=module, conn_type='client', resource='s3', region=location, endpoint=s3_url, **aws_connect_kwargs)
         if module.params['mode'] == 'put' and module.params['encryption_mode'] == 'aws:kms':
-            params['config'] = botocore.client.Config(signature_version='s3v4')
+            config = config.merge(botocore.client.Config(signature_version='s3v4'))
         elif module.params['mode'] in ('get', 'getstr') and sig_4:
-            params['config'] = botocore.client.Config(signature_version='s3v4')
+            config = config.merge(botocore.client.Config(signature_version='s3v4'))
         if module.params['dualstack']:
-            dualconf = botocore.client.Config(s3={'use_dualstack_endpoint': True})
-            if 'config' in params:
-                params['config'] = params['config'].merge(dualconf)
-            else:
-                params['config'] = dualconf
-    return boto3_conn(**params)
+            config = config.merge(botocore.client.Config(s3={'use_dualstack_endpoint': True}))
+
+    # Building a client re-resolves credentials and endpoints and starts a new
+    # connection pool.  Hand back the existing client when a call wouldn't
+    # change its settings, e.g. a SigV4 retry with a client that already
+    # signs with SigV4.
+    cache_key = (location, bool(rgw), s3_url, config.signature_version)
+    if cache_key not in _s3_client_cache:
+        params['config'] = config
+        _s3_client_cache[cache_key] = boto3_conn(**params)
+    return _s3_client_cache[cache_key]
 
 
 def get_current_object_tags_dict(s3, bucket, obj, version=None):
@@ -839,36 +1051,47 @@ def get_current_object_tags_dict(s3, bucket, obj, version=None):
     return boto3_tag_list_to_ansible_dict(current_tags)
 
 
-@AWSRetry.jittered_backoff(max_delay=120, catch_extra_error_codes=['NoSuchBucket', 'OperationAborted'])
+@AWSRetry.jittered_backoff(max_delay=120, catch_extra_error_codes=['NoSuchBucket', 'OperationAborted', 'SlowDown'])
 def put_object_tagging(s3, bucket, obj, tags):
     s3.put_object_tagging(Bucket=bucket, Key=obj, Tagging={'TagSet': ansible_dict_to_boto3_tag_list(tags)})
 
 
-@AWSRetry.jittered_backoff(max_delay=120, catch_extra_error_codes=['NoSuchBucket', 'OperationAborted'])
+@AWSRetry.jittered_backoff(max_delay=120, catch_extra_error_codes=['NoSuchBucket', 'OperationAborted', 'SlowDown'])
 def delete_object_tagging(s3, bucket, obj):
     s3.delete_object_tagging(Bucket=bucket, Key=obj)
 
 
 def wait_tags_are_applied(module, s3, bucket, obj, expected_tags_dict, version=None):
-    for dummy in range(0, 12):
+    deadline = time.time() + TAGS_WAIT_TIMEOUT
+    delay = 0.25
+    while True:
         try:
             current_tags_dict = get_current_object_tags_dict(s3, bucket, obj, version)
         except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
             module.fail_json_aws(e, msg="Failed to get object tags.")
-        if current_tags_dict != expected_tags_dict:
-            time.sleep(5)
-        else:
+        if current_tags_dict == expected_tags_dict:
             return current_tags_dict
+        if time.time() >= deadline:
+            break
+        # Exponential backoff with full jitter: tags usually show up quickly,
+        # and concurrent tasks don't end up polling in lockstep
+        time.sleep(random.uniform(0, min(5, delay)))
+        delay *= 2
 
     module.fail_json(msg="Object tags failed to apply in the expected time.",
                      requested_tags=expected_tags_dict, live_tags=current_tags_dict)
 
 
-def ensure_tags(client, module, bucket, obj):
+def ensure_tags(client, module, bucket, obj, new_object=False):
     tags = module.params.get("tags")
     purge_tags = module.params.get("purge_tags")
     changed = False
 
+    if new_object and tags is None:
+        # An object we've just written (without Tagging) has no tags, there's
+        # nothing to look up.
+        return {}, changed
+
     try:
         current_tags_dict = get_current_object_tags_dict(client, bucket, obj)
     except is_boto3_error_code(IGNORE_S3_DROP_IN_EXCEPTIONS):
@@ -909,6 +1132,8 @@ def main():
         headers=dict(type='dict'),
         marker=dict(default=""),
         max_keys=dict(default=1000, type='int', no_log=False),
+        max_concurrency=dict(default=16, type='int'),
+        multipart_chunksize=dict(type='int'),
         metadata=dict(type='dict'),
         mode=dict(choices=['get', 'put', 'delete', 'create', 'geturl', 'getstr', 'delobj', 'list', 'copy'], required=True),
         object=dict(),
@@ -953,7 +1178,6 @@ def main():
     version = module.params.get('version')
     overwrite = module.params.get('overwrite')
     prefix = module.params.get('prefix')
-    retries = module.params.get('retries')
     s3_url = module.params.get('s3_url')
     dualstack = module.params.get('dualstack')
     rgw = module.params.get('rgw')
@@ -962,11 +1186,13 @@ def main():
     content_base64 = module.params.get('content_base64')
     ignore_nonexistent_bucket = module.params.get('ignore_nonexistent_bucket')
 
-    object_canned_acl = ["private", "public-read", "public-read-write", "aws-exec-read", "authenticated-read", "bucket-owner-read", "bucket-owner-full-control"]
-    bucket_canned_acl = ["private", "public-read", "public-read-write", "authenticated-read"]
-
     validate_bucket_name(module, bucket)
 
+    if module.params.get('max_concurrency') < 1:
+        module.fail_json(msg='max_concurrency must be at least 1')
+    if module.params.get('multipart_chunksize') is not None and module.params.get('multipart_chunksize') < 1:
+        module.fail_json(msg='multipart_chunksize must be at least 1')
+
     if overwrite not in ['always', 'never', 'different', 'latest']:
         if module.boolean(overwrite):
             overwrite = 'always'
@@ -1018,14 +1244,25 @@ def main():
     validate = not ignore_nonexistent_bucket
 
     # separate types of ACLs
-    bucket_acl = [acl for acl in module.params.get('permission') if acl in bucket_canned_acl]
-    object_acl = [acl for acl in module.params.get('permission') if acl in object_canned_acl]
-    error_acl = [acl for acl in module.params.get('permission') if acl not in bucket_canned_acl and acl not in object_canned_acl]
+    bucket_acl = []
+    object_acl = []
+    error_acl = []
+    for acl in module.params.get('permission'):
+        if acl in BUCKET_CANNED_ACL:
+            bucket_acl.append(acl)
+        if acl in OBJECT_CANNED_ACL:
+            object_acl.append(acl)
+        elif acl not in BUCKET_CANNED_ACL:
+            error_acl.append(acl)
     if error_acl:
         module.fail_json(msg='Unknown permission specified: %s' % error_acl)
 
     # First, we check to see if the bucket exists, we get "bucket" returned.
-    bucketrtn = bucket_check(module, s3, bucket, validate=validate)
+    # delete_bucket does its own check, and without validation only the modes
+    # that may create the bucket or list it care about the answer.
+    bucketrtn = None
+    if mode in ('create', 'put', 'copy', 'list') or (validate and mode != 'delete'):
+        bucketrtn = bucket_check(module, s3, bucket, validate=validate)
 
     if validate and mode not in ('create', 'put', 'delete', 'copy') and not bucketrtn:
         module.fail_json(msg="Source bucket cannot be found.")
@@ -1047,12 +1284,12 @@ def main():
                 module.exit_json(msg="Local object is latest, ignoreing. Use overwrite=always parameter to force.", changed=False)
 
         try:
-            download_s3file(module, s3, bucket, obj, dest, retries, version=version)
+            download_s3file(module, s3, bucket, obj, dest, version=version)
         except Sigv4Required:
             s3 = get_s3_connection(module, aws_connect_kwargs, location, rgw, s3_url, sig_4=True)
-            download_s3file(module, s3, bucket, obj, dest, retries, version=version)
+            download_s3file(module, s3, bucket, obj, dest, version=version)
 
-    if mode == 'put':
+    elif mode == 'put':
 
         # if putting an object in a bucket yet to be created, acls for the bucket and/or the object may be specified
         # these were separated into the variables bucket_acl and object_acl above
@@ -1089,7 +1326,7 @@ def main():
         upload_s3file(module, s3, bucket, obj, expiry, metadata, encrypt, headers, src=src, content=bincontent)
 
     # Delete an object from a bucket, not the entire bucket
-    if mode == 'delobj':
+    elif mode == 'delobj':
         if obj is None:
             module.fail_json(msg="object parameter is required")
         if bucket:
@@ -1100,7 +1337,7 @@ def main():
             module.fail_json(msg="Bucket parameter is required.")
 
     # Delete an entire bucket, including all objects in the bucket
-    if mode == 'delete':
+    elif mode == 'delete':
         if bucket:
             deletertn = delete_bucket(module, s3, bucket)
             if deletertn is True:
@@ -1109,18 +1346,16 @@ def main():
             module.fail_json(msg="Bucket parameter is required.")
 
     # Support for listing a set of keys
-    if mode == 'list':
-        exists = bucket_check(module, s3, bucket)
-
+    elif mode == 'list':
         # If the bucket does not exist then bail out
-        if not exists:
+        if not bucketrtn:
             module.fail_json(msg="Target bucket (%s) cannot be found" % bucket)
 
         list_keys(module, s3, bucket, prefix, marker, max_keys)
 
     # Need to research how to create directories without "populating" a key, so this should just do bucket creation for now.
     # WE SHOULD ENABLE SOME WAY OF CREATING AN EMPTY KEY TO CREATE "DIRECTORY" STRUCTURE, AWS CONSOLE DOES THIS.
-    if mode == 'create':
+    elif mode == 'create':
 
         # if both creating a bucket and putting an object in it, acls for the bucket and/or the object may be specified
         # these were separated above into the variables bucket_acl and object_acl
@@ -1153,7 +1388,7 @@ def main():
                 create_dirkey(module, s3, bucket, dirobj, encrypt, expiry)
 
     # Support for grabbing the time-expired URL for an object in S3/Walrus.
-    if mode == 'geturl':
+    elif mode == 'geturl':
         if not bucket and not obj:
             module.fail_json(msg="Bucket and Object parameters must be set")
 
@@ -1164,7 +1399,7 @@ def main():
         else:
             module.fail_json(msg="Key %s does not exist." % obj)
 
-    if mode == 'getstr':
+    elif mode == 'getstr':
         if bucket and obj:
             keyrtn = key_check(module, s3, bucket, obj, version=version, validate=validate)
             if keyrtn:
@@ -1178,7 +1413,7 @@ def main():
             else:
                 module.fail_json(msg="Key %s does not exist." % obj)
 
-    if mode == 'copy':
+    elif mode == 'copy':
         # if copying an object in a bucket yet to be created, acls for the bucket and/or the object may be specified
         # these were separated into the variables bucket_acl and object_acl above
         d_etag = None
@@ -0,0 +1,33 @@
+# (c) 2021 Red Hat Inc.
+#
+# This file is part of Ansible
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import pytest
+
+from ansible_collections.amazon.aws.tests.unit.compat.mock import MagicMock
+from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
+
+
+class TestPassthrough(object):
+
+    @pytest.mark.parametrize("stdin", [{}], indirect=["stdin"])
+    def test_add_cleanup_file(self, monkeypatch, stdin):
+        module = AnsibleAWSModule(argument_spec=dict())
+        add_cleanup_file = MagicMock()
+        monkeypatch.setattr(module._module, 'add_cleanup_file', add_cleanup_file)
+
+        module.add_cleanup_file('/tmp/file')
+        add_cleanup_file.assert_called_once_with('/tmp/file')
+
+    @pytest.mark.parametrize("stdin", [{}], indirect=["stdin"])
+    def test_atomic_move(self, monkeypatch, stdin):
+        module = AnsibleAWSModule(argument_spec=dict())
+        atomic_move = MagicMock()
+        monkeypatch.setattr(module._module, 'atomic_move', atomic_move)
+
+        module.atomic_move('/tmp/src', '/tmp/dest')
+        atomic_move.assert_called_once_with('/tmp/src', '/tmp/dest')
@@ -7,6 +7,8 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+from hashlib import md5
+
 from ansible_collections.amazon.aws.tests.unit.compat.mock import MagicMock
 from ansible_collections.amazon.aws.plugins.module_utils import s3
 
@@ -38,3 +40,39 @@ def test_validate_bucket_name():
     module.fail_json.reset_mock()
     s3.validate_bucket_name(module, "doc-example-bucket-")
     assert module.fail_json.called
+
+
+def test_calculate_etag_single_part(tmp_path):
+    module = MagicMock()
+    client = MagicMock()
+
+    filename = tmp_path / "file"
+    filename.write_bytes(b"Hello, world!")
+    etag = s3.calculate_etag(module, str(filename), '"6cd3556deb0da54bca060b4c39479839"', client, "bucket", "key")
+    assert etag == '"6cd3556deb0da54bca060b4c39479839"'
+    assert not client.head_object.called
+
+    empty = tmp_path / "empty"
+    empty.write_bytes(b"")
+    etag = s3.calculate_etag(module, str(empty), '"d41d8cd98f00b204e9800998ecf8427e"', client, "bucket", "key")
+    assert etag == '"d41d8cd98f00b204e9800998ecf8427e"'
+
+
+def test_validate_bucket_name_invalid_not_cached():
+    module = MagicMock()
+
+    s3.validate_bucket_name(module, "Invalid-Bucket")
+    s3.validate_bucket_name(module, "Invalid-Bucket")
+    assert module.fail_json.call_count == 2
+
+
+def test_calculate_etag_content_multipart():
+    module = MagicMock()
+    client = MagicMock()
+    client.head_object.side_effect = [{'ContentLength': 7}, {'ContentLength': 6}]
+
+    content = b"Hello, world!"
+    expected = md5(md5(b"Hello, ").digest() + md5(b"world!").digest()).hexdigest()
+    etag = s3.calculate_etag_content(module, content, '"{0}-2"'.format(expected), client, "bucket", "key")
+    assert etag == '"{0}-2"'.format(expected)
+    assert client.head_object.call_count == 2
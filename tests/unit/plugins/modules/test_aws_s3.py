@@ -2,7 +2,11 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import datetime
+import os
+from ssl import SSLError
 import pytest
+import tempfile
 
 import unittest
 
@@ -13,7 +17,21 @@ except ImportError:
 
 from ansible.module_utils.six.moves.urllib.parse import urlparse
 
+from ansible_collections.amazon.aws.plugins.module_utils.core import AnsibleAWSModule
+from ansible_collections.amazon.aws.tests.unit.compat.mock import MagicMock
+from ansible_collections.amazon.aws.tests.unit.compat.mock import patch
+
 boto3 = pytest.importorskip("boto3")
+botocore = pytest.importorskip("botocore")
+
+
+class S3TestCase(unittest.TestCase):
+
+    def setUp(self):
+        # HeadObject responses and clients are memoized for the life of the
+        # module process, don't let them leak between tests
+        s3._head_object_cache.clear()
+        s3._s3_client_cache.clear()
 
 
 class TestUrlparse(unittest.TestCase):
@@ -25,14 +43,340 @@ class TestUrlparse(unittest.TestCase):
         self.assertEqual("/here", actual.path)
 
     def test_is_fakes3(self):
-        actual = s3.is_fakes3("fakes3://bla.blubb")
+        actual = s3.is_fakes3(urlparse("fakes3://bla.blubb"))
         self.assertEqual(True, actual)
 
+
+class TestGetS3Connection(S3TestCase):
+
     def test_get_s3_connection(self):
         aws_connect_kwargs = dict(aws_access_key_id="access_key",
                                   aws_secret_access_key="secret_key")
         location = None
         rgw = True
         s3_url = "http://bla.blubb"
-        actual = s3.get_s3_connection(None, aws_connect_kwargs, location, rgw, s3_url)
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(retries=3, max_concurrency=16)
+        actual = s3.get_s3_connection(module, aws_connect_kwargs, location, rgw, s3_url)
         self.assertEqual(bool("bla.blubb" in str(actual._endpoint)), True)
+        self.assertEqual(32, actual.meta.config.max_pool_connections)
+        self.assertEqual('adaptive', actual.meta.config.retries['mode'])
+
+    def test_get_s3_connection_presigned_url(self):
+        aws_connect_kwargs = dict(aws_access_key_id="access_key",
+                                  aws_secret_access_key="secret_key")
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(retries=0, max_concurrency=16, mode='geturl', encryption_mode='AES256', dualstack=False)
+        client = s3.get_s3_connection(module, aws_connect_kwargs, 'eu-west-1', False, None)
+        url = client.generate_presigned_url('get_object', Params={'Bucket': 'mybucket', 'Key': 'key'})
+        # botocore's default addressing and signature: the URL goes through the
+        # global endpoint, isn't limited to 7 days nor tied to the region
+        self.assertTrue(url.startswith('https://mybucket.s3.amazonaws.com/key'))
+        self.assertIn('AWSAccessKeyId=', url)
+
+    def test_get_s3_connection_sigv4_reuses_client(self):
+        aws_connect_kwargs = dict(aws_access_key_id="access_key",
+                                  aws_secret_access_key="secret_key")
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(retries=0, max_concurrency=16, mode='get', encryption_mode='AES256', dualstack=False)
+        client = s3.get_s3_connection(module, aws_connect_kwargs, 'eu-west-1', False, None)
+        self.assertIs(client, s3.get_s3_connection(module, aws_connect_kwargs, 'eu-west-1', False, None))
+        sigv4_client = s3.get_s3_connection(module, aws_connect_kwargs, 'eu-west-1', False, None, sig_4=True)
+        self.assertIsNot(client, sigv4_client)
+        self.assertEqual('s3v4', sigv4_client.meta.config.signature_version)
+        self.assertIs(sigv4_client, s3.get_s3_connection(module, aws_connect_kwargs, 'eu-west-1', False, None, sig_4=True))
+
+
+class TestTransferArgs(S3TestCase):
+
+    def test_get_transfer_config(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(multipart_chunksize=None, max_concurrency=16)
+        config = s3.get_transfer_config(module, 1024)
+        self.assertEqual(64 * 1024 * 1024, config.multipart_chunksize)
+        self.assertEqual(config.multipart_chunksize, config.multipart_threshold)
+        self.assertEqual(16, config.max_concurrency)
+
+        # 1 TiB in 64 MiB parts would need 16384 parts
+        size = 1024 ** 4
+        config = s3.get_transfer_config(module, size)
+        self.assertLessEqual(-(-size // config.multipart_chunksize), 10000)
+
+        module.params['multipart_chunksize'] = 8 * 1024 * 1024
+        self.assertEqual(8 * 1024 * 1024, s3.get_transfer_config(module, 1024).multipart_chunksize)
+
+    def test_get_download_transfer_config(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(multipart_chunksize=None, max_concurrency=16)
+        config = s3.get_download_transfer_config(module)
+        self.assertEqual(8 * 1024 * 1024, config.multipart_threshold)
+        self.assertEqual(16 * 1024 * 1024, config.multipart_chunksize)
+        self.assertEqual(16, config.max_concurrency)
+
+        module.params['multipart_chunksize'] = 32 * 1024 * 1024
+        config = s3.get_download_transfer_config(module)
+        self.assertEqual(32 * 1024 * 1024, config.multipart_threshold)
+        self.assertEqual(32 * 1024 * 1024, config.multipart_chunksize)
+
+    def test_metadata_to_extra_args(self):
+        self.assertEqual({'ContentType': 'text/plain', 'CacheControl': 'no-cache', 'Metadata': {'foo': 'bar'}},
+                         s3.metadata_to_extra_args({'Content-Type': 'text/plain', 'Cache-Control': 'no-cache', 'foo': 'bar'}))
+        self.assertEqual({'Metadata': {}}, s3.metadata_to_extra_args({}))
+
+
+class TestHeadObject(S3TestCase):
+
+    def test_head_object_is_cached(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        client = MagicMock()
+        client.head_object.return_value = {'ETag': '"abc"'}
+        self.assertTrue(s3.key_check(module, client, 'bucket', 'key'))
+        self.assertEqual('"abc"', s3.get_etag(client, 'bucket', 'key'))
+        client.head_object.assert_called_once_with(Bucket='bucket', Key='key')
+
+    def test_get_decision_uses_single_head_object(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        client = MagicMock()
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b'Hello, world!')
+            f.flush()
+            client.head_object.return_value = {
+                'ETag': '"6cd3556deb0da54bca060b4c39479839"',
+                'LastModified': datetime.datetime.fromtimestamp(os.path.getmtime(f.name) - 60),
+            }
+            self.assertTrue(s3.key_check(module, client, 'bucket', 'key'))
+            self.assertTrue(s3.etag_compare(module, client, 'bucket', 'key', local_file=f.name))
+            self.assertTrue(s3.is_local_object_latest(module, client, 'bucket', 'key', local_file=f.name))
+        client.head_object.assert_called_once_with(Bucket='bucket', Key='key')
+
+
+class TestPutCannedAcl(S3TestCase):
+
+    def test_put_canned_acl(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        client = MagicMock()
+        module.params = dict(permission=['private', 'public-read'])
+        s3.put_canned_acl(module, client, 'bucket', 'key')
+        client.put_object_acl.assert_called_once_with(ACL='public-read', Bucket='bucket', Key='key')
+
+        module.params = dict(permission=[])
+        client.reset_mock()
+        s3.put_canned_acl(module, client, 'bucket', 'key')
+        client.put_object_acl.assert_not_called()
+
+
+class TestDeleteBucket(S3TestCase):
+
+    def test_chunks(self):
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], list(s3.chunks(range(7), 3)))
+        self.assertEqual([], list(s3.chunks([], 3)))
+
+    def test_delete_bucket(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(max_concurrency=2)
+        client = MagicMock()
+        # ListObjectVersions pages can hold up to 1000 versions *and* delete markers
+        pages = [{'Versions': [{'Key': 'key%d' % i, 'VersionId': 'v1'} for i in range(1000)],
+                  'DeleteMarkers': [{'Key': 'key%d' % i, 'VersionId': 'v2'} for i in range(500)]}
+                 for dummy in range(4)]
+        client.get_paginator.return_value.paginate.return_value = pages
+        self.assertTrue(s3.delete_bucket(module, client, 'bucket'))
+        self.assertEqual(6, client.delete_objects.call_count)
+        for call in client.delete_objects.call_args_list:
+            self.assertTrue(call[1]['Delete']['Quiet'])
+            self.assertEqual(1000, len(call[1]['Delete']['Objects']))
+        client.delete_bucket.assert_called_once_with(Bucket='bucket')
+
+
+class TestDownloadS3File(S3TestCase):
+
+    def test_download_s3file(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(multipart_chunksize=None, max_concurrency=16, retries=0)
+        module.exit_json.side_effect = SystemExit
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 4}
+        client.download_fileobj.side_effect = lambda bucket, obj, f, **kwargs: kwargs['Callback'](f.write(b'data'))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, 'dest')
+            module.atomic_move.side_effect = os.rename
+            with self.assertRaises(SystemExit):
+                s3.download_s3file(module, client, 'bucket', 'key', dest)
+            with open(dest, 'rb') as f:
+                self.assertEqual(b'data', f.read())
+            self.assertEqual(['dest'], os.listdir(tmpdir))
+        client.get_object.assert_not_called()
+
+    def test_download_s3file_truncates_to_downloaded_size(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(multipart_chunksize=None, max_concurrency=16, retries=0)
+        module.exit_json.side_effect = SystemExit
+        client = MagicMock()
+        # The object was replaced by a smaller one after the HeadObject
+        client.head_object.return_value = {'ContentLength': 8}
+        client.download_fileobj.side_effect = lambda bucket, obj, f, **kwargs: kwargs['Callback'](f.write(b'data'))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, 'dest')
+            module.atomic_move.side_effect = os.rename
+            with self.assertRaises(SystemExit):
+                s3.download_s3file(module, client, 'bucket', 'key', dest)
+            with open(dest, 'rb') as f:
+                self.assertEqual(b'data', f.read())
+
+    def test_download_s3file_retries_ssl_errors(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(multipart_chunksize=None, max_concurrency=16, retries=1)
+        module.exit_json.side_effect = SystemExit
+        module.fail_json_aws.side_effect = SystemExit
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 4}
+        client.download_fileobj.side_effect = [SSLError('read error'), None]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(SystemExit):
+                s3.download_s3file(module, client, 'bucket', 'key', os.path.join(tmpdir, 'dest'))
+        self.assertEqual(2, client.download_fileobj.call_count)
+        module.fail_json_aws.assert_not_called()
+
+        client.download_fileobj.side_effect = s3.RetriesExceededError(SSLError('read error'))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(SystemExit):
+                s3.download_s3file(module, client, 'bucket', 'key', os.path.join(tmpdir, 'dest'))
+        module.fail_json_aws.assert_called_once()
+
+    def test_download_s3file_requires_sigv4(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(multipart_chunksize=None, max_concurrency=16, retries=0)
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 4}
+        client.download_fileobj.side_effect = botocore.exceptions.ClientError(
+            {'Error': {'Code': 'InvalidArgument',
+                       'Message': 'Requests specifying Server Side Encryption with AWS KMS managed keys require AWS Signature Version 4.'}},
+            'GetObject')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(s3.Sigv4Required):
+                s3.download_s3file(module, client, 'bucket', 'key', os.path.join(tmpdir, 'dest'))
+        module.fail_json_aws.assert_not_called()
+
+
+class TestCopyObject(S3TestCase):
+
+    def test_copy_object_to_bucket_single_head_object(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.check_mode = False
+        module.params = dict(copy_src=dict(bucket='src', object='src-key'), permission=[], tags=None, purge_tags=True,
+                             encryption_mode='AES256', encryption_kms_key_id=None)
+        module.exit_json.side_effect = SystemExit
+        client = MagicMock()
+        client.head_object.return_value = {'ETag': '"abc"', 'ContentLength': 3}
+        client.get_object_tagging.return_value = {'TagSet': []}
+
+        with self.assertRaises(SystemExit):
+            s3.copy_object_to_bucket(module, client, 'dst', 'dst-key', False, None, True, None)
+
+        client.head_object.assert_called_once_with(Bucket='src', Key='src-key')
+        client.copy_object.assert_called_once_with(Bucket='dst', Key='dst-key', CopySource={'Bucket': 'src', 'Key': 'src-key'})
+
+    def test_copy_object_multipart(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(max_concurrency=4)
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 8}
+        client.get_object_tagging.return_value = {'TagSet': [{'Key': 'k', 'Value': 'v'}]}
+        client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        client.upload_part_copy.side_effect = lambda **kwargs: {'CopyPartResult': {'ETag': kwargs['CopySourceRange']}}
+        src_head = {'ContentLength': 20, 'ContentType': 'text/plain', 'Metadata': {'a': 'b'}}
+        params = {'Bucket': 'dst', 'Key': 'dst-key', 'CopySource': {'Bucket': 'src', 'Key': 'src-key'}}
+
+        s3.copy_object_multipart(module, client, params, src_head)
+
+        client.create_multipart_upload.assert_called_once_with(Bucket='dst', Key='dst-key', ContentType='text/plain',
+                                                               Metadata={'a': 'b'}, Tagging='k=v')
+        client.complete_multipart_upload.assert_called_once_with(
+            Bucket='dst', Key='dst-key', UploadId='upload',
+            MultipartUpload={'Parts': [{'PartNumber': 1, 'ETag': 'bytes=0-7'},
+                                       {'PartNumber': 2, 'ETag': 'bytes=8-15'},
+                                       {'PartNumber': 3, 'ETag': 'bytes=16-19'}]})
+        client.abort_multipart_upload.assert_not_called()
+
+    def test_copy_object_multipart_keeps_source_metadata(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(max_concurrency=4)
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 8}
+        client.get_object_tagging.return_value = {'TagSet': []}
+        client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        src_head = {'ContentLength': 8, 'ContentType': 'text/plain', 'Metadata': {'a': 'b'}}
+        params = {'Bucket': 'dst', 'Key': 'dst-key', 'CopySource': {'Bucket': 'src', 'Key': 'src-key'},
+                  'ContentType': 'application/json', 'CacheControl': 'no-cache', 'Metadata': {},
+                  'StorageClass': 'STANDARD_IA'}
+
+        s3.copy_object_multipart(module, client, params, src_head)
+
+        client.create_multipart_upload.assert_called_once_with(Bucket='dst', Key='dst-key', ContentType='text/plain',
+                                                               Metadata={'a': 'b'}, StorageClass='STANDARD_IA')
+
+    def test_copy_object_multipart_forwards_request_args(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(max_concurrency=4)
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 8}
+        client.get_object_tagging.return_value = {'TagSet': []}
+        client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+        client.upload_part_copy.return_value = {'CopyPartResult': {'ETag': '"part"'}}
+        sse = dict(SSECustomerAlgorithm='AES256', SSECustomerKey='key', SSECustomerKeyMD5='md5')
+        params = dict(Bucket='dst', Key='dst-key', CopySource={'Bucket': 'src', 'Key': 'src-key'}, RequestPayer='requester', **sse)
+
+        s3.copy_object_multipart(module, client, params, {'ContentLength': 8})
+
+        client.upload_part_copy.assert_called_once_with(Bucket='dst', Key='dst-key', UploadId='upload', PartNumber=1,
+                                                        CopySource={'Bucket': 'src', 'Key': 'src-key'}, CopySourceRange='bytes=0-7',
+                                                        RequestPayer='requester', **sse)
+        client.complete_multipart_upload.assert_called_once_with(Bucket='dst', Key='dst-key', UploadId='upload',
+                                                                 MultipartUpload={'Parts': [{'PartNumber': 1, 'ETag': '"part"'}]},
+                                                                 RequestPayer='requester')
+
+    def test_copy_object_multipart_empty_first_part(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(max_concurrency=4)
+        client = MagicMock()
+        client.head_object.return_value = {'ContentLength': 0}
+        params = {'Bucket': 'dst', 'Key': 'dst-key', 'CopySource': {'Bucket': 'src', 'Key': 'src-key'}}
+
+        s3.copy_object_multipart(module, client, params, {'ContentLength': 0, 'ETag': '"abc-1"'})
+
+        client.copy_object.assert_called_once_with(**params)
+        client.create_multipart_upload.assert_not_called()
+
+
+class TestObjectTags(S3TestCase):
+
+    def test_ensure_tags_new_object(self):
+        module = MagicMock(spec=AnsibleAWSModule)
+        module.params = dict(tags=None, purge_tags=True)
+        client = MagicMock()
+        self.assertEqual(({}, False), s3.ensure_tags(client, module, 'bucket', 'key', new_object=True))
+        client.get_object_tagging.assert_not_called()
+
+    @patch('time.sleep')
+    def test_wait_tags_are_applied(self, sleep):
+        module = MagicMock(spec=AnsibleAWSModule)
+        client = MagicMock()
+        client.get_object_tagging.side_effect = [
+            {'TagSet': []},
+            {'TagSet': []},
+            {'TagSet': [{'Key': 'k', 'Value': 'v'}]},
+        ]
+        self.assertEqual({'k': 'v'}, s3.wait_tags_are_applied(module, client, 'bucket', 'key', {'k': 'v'}))
+        self.assertEqual(2, sleep.call_count)
+        for call in sleep.call_args_list:
+            self.assertLessEqual(call[0][0], 5)
+        module.fail_json.assert_not_called()